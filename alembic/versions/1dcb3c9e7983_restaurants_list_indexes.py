@@ -0,0 +1,36 @@
+"""restaurants list indexes
+
+Revision ID: 1dcb3c9e7983
+Revises: 844a4c8d1318
+Create Date: 2026-10-15 20:30:41.118532
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '1dcb3c9e7983'
+down_revision: Union[str, Sequence[str], None] = '844a4c8d1318'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # trigram индексът (търсене по име с ILIKE '%q%') иска pg_trgm
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    # CONCURRENTLY → без lock на таблицата за писане докато се строят; не може в транзакция
+    with op.get_context().autocommit_block():
+        op.create_index('ix_restaurants_active_org_id', 'restaurants', ['organization_id', 'id'], unique=False, postgresql_where=sa.text('is_deleted = false'), postgresql_concurrently=True)
+        op.create_index('ix_restaurants_name_trgm', 'restaurants', ['name'], unique=False, postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # pg_trgm остава — може да се ползва и от други обекти
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_restaurants_name_trgm', table_name='restaurants', postgresql_using='gin', postgresql_concurrently=True)
+        op.drop_index('ix_restaurants_active_org_id', table_name='restaurants', postgresql_where=sa.text('is_deleted = false'), postgresql_concurrently=True)
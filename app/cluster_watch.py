@@ -0,0 +1,324 @@
+# app/cluster_watch.py
+"""
+Фонов watch на HelmRelease-ите и Pod-овете в кластера.
+
+По една нишка на ресурс държи отворен watch (с resourceVersion resume) и
+поддържа в паметта статуса на всяка организация, conditions на HelmRelease-ите
+на ресторантите и обобщение на Pod-овете по namespace. Промяна, която може да
+смени статус на организация/ресторант, събужда app.status_sync, който записва
+новите статуси в БД (push, не polling).
+"""
+import logging
+import threading
+
+from kubernetes import client, watch
+
+from .k8s_client import get_clients
+from .flux_provisioner import helmrelease_state, helmrelease_version, list_pages, pod_summary, pods_state
+
+log = logging.getLogger(__name__)
+
+_org_states: dict[str, str] = {}   # namespace (= име на организация) → "running" | "progressing" | "error"
+_org_hrs: dict[str, str | None] = {}   # namespace с org HelmRelease (и без категоричен статус) → версия в spec-а
+_release_hrs: dict[str, dict[str, dict]] = {}   # namespace → {име на HelmRelease (не org) → _hr_lite}
+_pods_by_ns: dict[str, dict[str, tuple]] = {}   # namespace → {pod name → pod_summary}
+_synced = {"helmreleases": False, "pods": False}
+_lock = threading.Lock()
+_stop = threading.Event()
+_changed = threading.Event()   # вдига се при нов list или при промяна на статус на организация/ресторант
+_threads: list[threading.Thread] = []
+
+_RETRY_SECONDS = 5          # първи retry след грешка; после се удвоява до _MAX_RETRY_SECONDS
+_MAX_RETRY_SECONDS = 300
+_WATCH_TIMEOUT_SECONDS = 300
+
+
+def start():
+    """Пуска watch нишките (веднъж на процес)."""
+    if any(t.is_alive() for t in _threads):
+        return
+    _stop.clear()
+    _threads[:] = [
+        threading.Thread(target=_run, args=(_HELMRELEASES,), name="helmrelease-watch", daemon=True),
+        threading.Thread(target=_run, args=(_PODS,), name="pod-watch", daemon=True),
+    ]
+    for t in _threads:
+        t.start()
+
+
+def stop():
+    _stop.set()
+
+
+def watched_org_statuses(names: list[str]) -> dict[str, str]:
+    """
+    Статусите от watch-а за подадените организации: по HelmRelease, а ако той
+    няма категоричен резултат — по кеша на Pod-овете в namespace-а.
+    Липсват тези, за които watch-ът не може да каже (или не е синхронизиран).
+    """
+    result = {}
+    with _lock:
+        if not _synced["helmreleases"]:
+            return result
+        for name in names:
+            if name in _org_states:
+                result[name] = _org_states[name]
+            elif _synced["pods"]:
+                result[name] = pods_state(list(_pods_by_ns.get(name, {}).values()))
+    return result
+
+
+def watched_namespace_helmreleases(namespaces) -> dict[str, dict[str, dict]] | None:
+    """HelmRelease-ите (без тези на организациите) по namespace и име; None, ако watch-ът не е синхронизиран."""
+    with _lock:
+        if not _synced["helmreleases"]:
+            return None
+        return {ns: dict(_release_hrs.get(ns, {})) for ns in namespaces}
+
+
+def watched_release_versions(keys) -> dict[tuple[str, str], str | None] | None:
+    """
+    Версията в spec-а на HelmRelease-а по (namespace, име) (None, ако го няма);
+    None вместо речник, ако watch-ът не е синхронизиран.
+    """
+    with _lock:
+        if not _synced["helmreleases"]:
+            return None
+        result = {}
+        for ns, name in keys:
+            if name == ns:
+                result[(ns, name)] = _org_hrs.get(ns)
+            else:
+                hr = _release_hrs.get(ns, {}).get(name)
+                result[(ns, name)] = hr["version"] if hr is not None else None
+        return result
+
+
+def watched_pod_states(namespaces) -> dict[str, str] | None:
+    """pods_state по namespace ("running" | "progressing" | "error"); None, ако watch-ът не е синхронизиран."""
+    with _lock:
+        if not _synced["pods"]:
+            return None
+        return {ns: pods_state(list(_pods_by_ns.get(ns, {}).values())) for ns in namespaces}
+
+
+def wait_for_change(timeout: float):
+    """Чака промяна от някой watch (или timeout) и нулира флага."""
+    _changed.wait(timeout)
+    _changed.clear()
+
+
+class _Resource:
+    """Какво и как се следи: list функция + как се прилагат list-ът и събитията."""
+
+    def __init__(self, kind, list_func, list_kwargs, reset, apply):
+        self.kind = kind
+        self.list_func = list_func       # (core, crd) → list функция на клиента
+        self.list_kwargs = list_kwargs   # аргументи към нея (и за list, и за watch)
+        self.reset = reset               # (items) → ново пълно състояние (сам взима _lock)
+        self.apply = apply               # (event type, object) → прилага една промяна (под _lock);
+                                         # True, ако тя може да смени статус в БД
+
+
+def _run(res: _Resource):
+    resource_version = None
+    retry_seconds = _RETRY_SECONDS
+
+    while not _stop.is_set():
+        try:
+            list_func = res.list_func(*get_clients())
+
+            # 1) Пълен list → начално състояние + resourceVersion, от който тръгва watch-ът
+            if resource_version is None:
+                list_meta: dict = {}
+                res.reset(_items(list_pages(list_func, **res.list_kwargs), list_meta))
+                resource_version = list_meta["resourceVersion"]
+                with _lock:
+                    _synced[res.kind] = True
+                _changed.set()
+
+            # 2) Watch от този resourceVersion нататък — само промените
+            # return_type="object" → събитията остават dict, без модели
+            w = watch.Watch(return_type="object")
+            for event in w.stream(
+                list_func,
+                **res.list_kwargs,
+                resource_version=resource_version,
+                allow_watch_bookmarks=True,
+                timeout_seconds=_WATCH_TIMEOUT_SECONDS,
+            ):
+                resource_version = event["raw_object"]["metadata"]["resourceVersion"]
+                retry_seconds = _RETRY_SECONDS   # watch-ът работи → backoff-ът започва отначало
+                if event["type"] == "BOOKMARK":
+                    continue
+                with _lock:
+                    changed = res.apply(event["type"], event["object"])
+                # status_sync се буди само при реална промяна (не при всеки restart/probe на pod)
+                if changed:
+                    _changed.set()
+                if _stop.is_set():
+                    w.stop()
+            # watch-ът приключва по timeout → продължаваме от последния resourceVersion
+            retry_seconds = _RETRY_SECONDS
+            continue
+
+        except client.ApiException as e:
+            if e.status == 410:
+                # 410 Gone: resourceVersion-ът е изтекъл → нов list
+                resource_version = None
+                continue
+            if e.status in (401, 403):
+                # Без права за cluster-wide list/watch (напр. само namespaced Role) → повторен
+                # опит няма да помогне: оставаме без watch, статусите се четат директно от кластера
+                log.warning("%s watch disabled (%s %s): falling back to direct cluster reads", res.kind, e.status, e.reason)
+                with _lock:
+                    _synced[res.kind] = False
+                return
+            log.warning("%s watch failed: %s (retry in %ss)", res.kind, e, retry_seconds)
+        except Exception:
+            log.exception("%s watch crashed (retry in %ss)", res.kind, retry_seconds)
+
+        # Докато няма watch, не връщаме остарели данни → ендпойнтът пита кластера директно
+        with _lock:
+            _synced[res.kind] = False
+        resource_version = None
+        _stop.wait(retry_seconds)
+        retry_seconds = min(retry_seconds * 2, _MAX_RETRY_SECONDS)
+
+
+def _items(pages, list_meta: dict):
+    """Обектите от всички страници една след друга; list_meta получава metadata на последната."""
+    for page in pages:
+        list_meta.update(page.get("metadata") or {})
+        yield from page.get("items") or []
+
+
+# --- HelmRelease-и ---
+
+def _hr_reset(items):
+    # новото състояние се строи страница по страница извън lock-а и се подменя наведнъж
+    states = {}
+    org_hrs = {}
+    release_hrs: dict[str, dict[str, dict]] = {}
+    for item in items:
+        ns, name = _hr_key(item)
+        if ns is None:
+            continue
+        if name == ns:
+            org_hrs[ns] = helmrelease_version(item)
+            state = helmrelease_state(item)
+            if state is not None:
+                states[ns] = state
+        else:
+            release_hrs.setdefault(ns, {})[name] = _hr_lite(item)
+    with _lock:
+        _org_states.clear()
+        _org_states.update(states)
+        _org_hrs.clear()
+        _org_hrs.update(org_hrs)
+        _release_hrs.clear()
+        _release_hrs.update(release_hrs)
+
+
+def _hr_apply(event_type: str, obj: dict) -> bool:
+    ns, name = _hr_key(obj)
+    if ns is None:
+        return False
+    if name == ns:
+        # org HelmRelease (име = namespace)
+        old = (ns in _org_hrs, _org_hrs.get(ns), _org_states.get(ns))
+        state = None if event_type == "DELETED" else helmrelease_state(obj)
+        if event_type == "DELETED":
+            _org_hrs.pop(ns, None)
+        else:
+            _org_hrs[ns] = helmrelease_version(obj)
+        if state is None:
+            _org_states.pop(ns, None)
+        else:
+            _org_states[ns] = state
+        return (ns in _org_hrs, _org_hrs.get(ns), state) != old
+
+    hrs = _release_hrs.get(ns)
+    old = hrs.get(name) if hrs is not None else None
+    if event_type == "DELETED":
+        if old is None:
+            return False
+        del hrs[name]
+        if not hrs:
+            del _release_hrs[ns]
+        return True
+    lite = _hr_lite(obj)
+    _release_hrs.setdefault(ns, {})[name] = lite
+    return lite != old
+
+
+def _hr_key(obj: dict) -> tuple[str | None, str | None]:
+    meta = obj.get("metadata") or {}
+    ns, name = meta.get("namespace"), meta.get("name")
+    if not ns or not name:
+        return None, None
+    return ns, name
+
+
+def _hr_lite(obj: dict) -> dict:
+    """
+    От HelmRelease-а пазим само версията от spec-а и type/status/reason на conditions —
+    само тях ползва sync-ът; така и сравнението стар/нов не вижда промени по message/време.
+    """
+    conditions = (obj.get("status") or {}).get("conditions") or []
+    return {
+        "version": helmrelease_version(obj),
+        "status": {"conditions": [
+            {"type": c.get("type"), "status": c.get("status"), "reason": c.get("reason")}
+            for c in conditions
+        ]},
+    }
+
+
+_HELMRELEASES = _Resource(
+    "helmreleases",
+    lambda core, crd: crd.list_cluster_custom_object,
+    {"group": "helm.toolkit.fluxcd.io", "version": "v2", "plural": "helmreleases"},
+    _hr_reset,
+    _hr_apply,
+)
+
+
+# --- Pod-ове ---
+
+def _pod_reset(items):
+    pods_by_ns: dict[str, dict[str, tuple]] = {}
+    for pod in items:
+        meta = pod["metadata"]
+        pods_by_ns.setdefault(meta["namespace"], {})[meta["name"]] = pod_summary(pod)
+    with _lock:
+        _pods_by_ns.clear()
+        _pods_by_ns.update(pods_by_ns)
+
+
+def _pod_apply(event_type: str, pod: dict) -> bool:
+    ns, name = pod["metadata"]["namespace"], pod["metadata"]["name"]
+    pods = _pods_by_ns.get(ns)
+    old = pods.get(name) if pods is not None else None
+    if event_type == "DELETED":
+        if old is None:
+            return False
+        del pods[name]
+        if not pods:
+            del _pods_by_ns[ns]
+        changed = True
+    else:
+        summary = pod_summary(pod)
+        _pods_by_ns.setdefault(ns, {})[name] = summary
+        changed = summary != old
+    # Pod-ове извън namespace-ите на организациите (kube-system и т.н.) не влияят на статусите
+    return changed and (ns in _org_hrs or ns in _release_hrs)
+
+
+_PODS = _Resource(
+    "pods",
+    lambda core, crd: core.list_pod_for_all_namespaces,
+    {},
+    _pod_reset,
+    _pod_apply,
+)
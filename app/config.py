@@ -3,6 +3,12 @@ from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class Settings(BaseSettings):
     DATABASE_URL: str
+    # Connection pool: sync endpoint-ите вървят в threadpool-а на FastAPI (40 нишки по
+    # подразбиране) → pool_size + max_overflow = 40, за да не чакат нишките за връзка
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 30
+    DB_POOL_TIMEOUT: int = 10                     # секунди чакане за свободна връзка, после грешка
+    DB_POOL_RECYCLE: int = 1800                   # секунди; по-стари връзки се отварят наново
 
     # JWT / Security
     SECRET_KEY: str
@@ -24,6 +30,8 @@ class Settings(BaseSettings):
     FLUX_SOURCE_NAME: str = "org-stack"           # името от gitrepository.yaml
     FLUX_SOURCE_NAMESPACE: str = "flux-system"
     CHART_PATH: str = "charts/org-stack"          # пътят до чарта в твоето repo
+    K8S_POOL_MAXSIZE: int = 64                    # паралелни връзки към API сървъра (threadpool + watch-ове + probe-ове)
+    STATUS_SYNC_INTERVAL_SECONDS: int = 10        # на колко време статусите в БД се сверяват с кластера (и при всяка промяна от watch-а)
 
     model_config = SettingsConfigDict(env_file=".env", case_sensitive=False)
 
@@ -1,9 +1,40 @@
 # app/flux_provisioner.py
+import json
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from cachetools import TTLCache
 from kubernetes import client
 from .k8s_client import get_clients
 from .config import settings
 
 
+_PAGE_LIMIT = 500
+
+
+def list_pages(list_func, **kwargs):
+    """
+    Обхожда list_* функция на клиента на страници по _PAGE_LIMIT обекта
+    (continue token), за да не държим целия списък от клъстера в паметта.
+
+    resourceVersion не се задава: с resourceVersion=0 kube-apiserver отговаря от
+    watch кеша си и игнорира limit-а (връща всичко наведнъж, без continue), т.е.
+    страниците реално работят само при консистентно четене. Всички страници са
+    от един и същ snapshot (continue token-ът го носи).
+    Страниците се връщат като суров JSON (dict) — без десериализация в модели
+    (V1Pod и т.н.), от които ползваме само няколко полета.
+    """
+    resp = list_func(**kwargs, limit=_PAGE_LIMIT, _preload_content=False)
+    while True:
+        page = json.loads(resp.data)
+        yield page
+        token = (page.get("metadata") or {}).get("continue")
+        if not token:
+            return
+        resp = list_func(**kwargs, limit=_PAGE_LIMIT, _continue=token, _preload_content=False)
+
+
 def ensure_namespace(name: str):
     core, _ = get_clients()
     ns = client.V1Namespace(metadata=client.V1ObjectMeta(name=name))
@@ -14,6 +45,32 @@ def ensure_namespace(name: str):
             raise
 
 
+# Статичните части на HelmRelease body-тата (не зависят от организацията/ресторанта)
+# се строят веднъж при import и се споделят между заявките — само за четене, не ги мутирай.
+_ORG_CHART = {
+    "spec": {
+        "chart": settings.CHART_PATH,
+        "sourceRef": {
+            "kind": settings.FLUX_SOURCE_KIND,
+            "name": settings.FLUX_SOURCE_NAME,
+            "namespace": settings.FLUX_SOURCE_NAMESPACE,
+        },
+    }
+}
+_RESTAURANT_CHART = {
+    "spec": {
+        "chart": "charts/restaurant-stack",
+        "sourceRef": {
+            "kind": "GitRepository",
+            "name": "restaurant-stack",
+            "namespace": "flux-system",
+        },
+    }
+}
+_REMEDIATION = {"remediation": {"retries": 3}}
+_INGRESS = {"baseDomain": settings.BASE_DOMAIN}
+
+
 def apply_helmrelease(name: str, backend_tag: str, frontend_tag: str):
     _, crd = get_clients()
     body = {
@@ -22,21 +79,12 @@ def apply_helmrelease(name: str, backend_tag: str, frontend_tag: str):
         "metadata": {"name": name, "namespace": name},
         "spec": {
             "interval": "5m",
-            "chart": {
-                "spec": {
-                    "chart": settings.CHART_PATH,
-                    "sourceRef": {
-                        "kind": settings.FLUX_SOURCE_KIND,
-                        "name": settings.FLUX_SOURCE_NAME,
-                        "namespace": settings.FLUX_SOURCE_NAMESPACE,
-                    },
-                }
-            },
-            "install": {"remediation": {"retries": 3}},
-            "upgrade": {"remediation": {"retries": 3}},
+            "chart": _ORG_CHART,
+            "install": _REMEDIATION,
+            "upgrade": _REMEDIATION,
             "values": {
                 "orgName": name,
-                "ingress": {"baseDomain": settings.BASE_DOMAIN},
+                "ingress": _INGRESS,
                 "images": {
                     "backend":  {"repository": "ghcr.io/zdravkobonev/organization-be", "tag": backend_tag},
                     "frontend": {"repository": "ghcr.io/zdravkobonev/organization-fe", "tag": frontend_tag},
@@ -59,16 +107,45 @@ def apply_helmrelease(name: str, backend_tag: str, frontend_tag: str):
             raise
 
 
-def get_org_status(namespace: str) -> str:
+def provision_organizations(items: list[tuple[str, str, str]]) -> dict[str, Exception]:
     """
-    Връща общ статус за организацията в дадения namespace:
-      - "running"     → всичко е Ready (по HelmRelease Ready=True или всички pod-ове Ready)
-      - "progressing" → още се вдига/реконсайлинг (Ready=False/Unknown, без грешки)
-      - "error"       → има провали (Failed/Degraded, CrashLoopBackOff, ImagePullBackOff, и т.н.)
+    Вдига/обновява няколко организации паралелно: за всяка (name, backend_tag, frontend_tag)
+    ensure_namespace + apply_helmrelease (в този ред), а организациите — едновременно,
+    така че K организации отнемат ~1 round trip вместо K.
+    Връща {name: грешка} за тези, които са се провалили.
     """
+    def provision(item: tuple[str, str, str]) -> Exception | None:
+        name, backend_tag, frontend_tag = item
+        try:
+            ensure_namespace(name)
+            apply_helmrelease(name, backend_tag, frontend_tag)
+        except Exception as e:
+            return e
+        return None
+
+    errors = _k8s_pool.map(provision, items)
+    return {item[0]: e for item, e in zip(items, errors) if e is not None}
+
+
+# Последният известен статус на организация: ако четенето на HelmRelease гръмне,
+# връщаме него вместо да листваме Pod-овете (скъпата заявка).
+_last_known: TTLCache = TTLCache(maxsize=1024, ttl=300)
+_last_known_lock = threading.Lock()
+
+# Пул за паралелни заявки към кластера: проверки по namespace (когато няма как
+# с една заявка) и bulk provisioning
+_k8s_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="k8s")
+
+
+def map_concurrently(func, items) -> list:
+    """func върху всеки елемент паралелно (на общия пул за заявки към кластера); резултатите са в реда на items."""
+    return list(_k8s_pool.map(func, items))
+
+
+def _fetch_org_status(namespace: str) -> str:
     core, crd = get_clients()
 
-    # 1) Опитай да прочетеш HelmRelease (Flux v2)
+    # 1) Опитай да прочетеш HelmRelease (Flux v2); Ready=True → "running" веднага, без Pod-ове
     try:
         hr = crd.get_namespaced_custom_object(
             group="helm.toolkit.fluxcd.io",
@@ -77,108 +154,207 @@ def get_org_status(namespace: str) -> str:
             plural="helmreleases",
             name=namespace,
         )
-
-        status = (hr or {}).get("status", {}) or {}
-        conditions = status.get("conditions", []) or []
-
-        # Намери Ready condition, ако има
-        ready = _find_condition(conditions, "Ready")
-        if ready:
-            cond_status = (ready.get("status") or "").lower()        # "True" / "False" / "Unknown"
-            reason = (ready.get("reason") or "").lower()             # "ReconciliationSucceeded", "Progressing", "InstallFailed", ...
-            # Хепи път
-            if cond_status == "true":
-                return "running"
-            # В процес (Flux често маркира Progressing/Reconciling като False/Unknown докато се вдига)
-            if cond_status in {"false", "unknown"} and any(
-                k in reason for k in ("progress", "reconcil", "pending")
-            ):
-                return "progressing"
-            # Всичко друго с False/Unknown → вероятно проблем
-            if cond_status in {"false", "unknown"}:
-                # ако reason подсказва временно състояние, не е error
-                if any(k in reason for k in ("wait", "poll", "retry")):
-                    return "progressing"
-                return "error"
-
-        # Ако няма Ready condition, погледни други сигнали
-        if _any_failed_condition(conditions):
-            return "error"
-
-        # Ако има status.conditions, но нищо категорично → progressing
-        if conditions:
-            return "progressing"
+        state = helmrelease_state(hr)
+        if state is not None:
+            return state
 
     except client.ApiException as e:
         if e.status == 404:
             # Няма HelmRelease все още → progressing (предполагаме, че ще се създаде скоро)
             pass
         else:
-            # Ако API-то гръмне → ще проверим Pod-ове; ако и това гръмне, връщаме "error"
-            pass
+            # Ако API-то гръмне → последният известен статус, ако имаме;
+            # иначе ще проверим Pod-ове; ако и това гръмне, връщаме "error"
+            with _last_known_lock:
+                stale = _last_known.get(namespace)
+            if stale is not None:
+                return stale
 
     # 2) Fallback: проверка на Pod-ове в namespace-а
     try:
-        pods = (core.list_namespaced_pod(namespace=namespace).items) or []
-        if not pods:
-            return "progressing"
+        summaries = [
+            pod_summary(p)
+            for page in list_pages(core.list_namespaced_pod, namespace=namespace)
+            for p in page.get("items") or []
+        ]
+        return pods_state(summaries)
+
+    except Exception:
+        # Неуспешна проверка → счита се за проблем
+        return "error"
 
-        any_error = False
-        all_ready = True
 
-        for p in pods:
-            cstatuses = p.status.container_statuses or []
-            if not cstatuses:
-                all_ready = False
-                continue
-            for cs in cstatuses:
-                st = cs.state
-                # Грешки при стартиране/имиджи
-                if st and st.waiting and st.waiting.reason in {
-                    "CrashLoopBackOff",
-                    "ErrImagePull",
-                    "ImagePullBackOff",
-                    "CreateContainerConfigError",
-                    "CreateContainerError",
-                }:
-                    any_error = True
-                # Не е готов
-                if not cs.ready:
-                    all_ready = False
-
-        if any_error:
+def get_all_org_statuses(names: list[str]) -> dict[str, str]:
+    """
+    Общ статус на организациите по namespace:
+      - "running"     → всичко е Ready (по HelmRelease Ready=True или всички pod-ове Ready)
+      - "progressing" → още се вдига/реконсайлинг (Ready=False/Unknown, без грешки)
+      - "error"       → има провали (Failed/Degraded, CrashLoopBackOff, ImagePullBackOff, и т.н.)
+    С един cluster-wide list на HelmRelease-ите (+ list на Pod-ове само в namespace-ите
+    на организациите без категоричен резултат), вместо 2 заявки на организация.
+    Връща {име на организация: "running" | "progressing" | "error"}.
+    """
+    if not names:
+        return {}
+    result = _fetch_all_org_statuses(names)
+    with _last_known_lock:
+        _last_known.update(result)
+    return result
+
+
+def _fetch_all_org_statuses(names: list[str]) -> dict[str, str]:
+    core, crd = get_clients()
+    wanted = set(names)
+    result: dict[str, str] = {}
+
+    # 1) Всички HelmRelease-и с една заявка (на страници); org HelmRelease-ът е с име = namespace
+    try:
+        for page in list_pages(
+            crd.list_cluster_custom_object,
+            group="helm.toolkit.fluxcd.io",
+            version="v2",
+            plural="helmreleases",
+        ):
+            for item in page.get("items") or []:
+                meta = item["metadata"]
+                if meta["name"] != meta["namespace"] or meta["namespace"] not in wanted:
+                    continue
+                state = helmrelease_state(item)
+                if state is not None:
+                    result[meta["namespace"]] = state
+    except client.ApiException:
+        # Без права за cluster-wide list (напр. само namespaced Role) → проверяваме
+        # всяка организация поотделно, но паралелно, а не една след друга.
+        return dict(zip(names, _k8s_pool.map(_fetch_org_status, names)))
+
+    missing = [name for name in names if name not in result]
+    if not missing:
+        return result
+
+    # 2) Fallback: Pod-овете само в namespace-ите без категоричен резултат —
+    # list по namespace (паралелно), а не всички Pod-ове в кластера
+    def pods_fallback(name: str) -> str:
+        try:
+            return pods_state([
+                pod_summary(p)
+                for page in list_pages(core.list_namespaced_pod, namespace=name)
+                for p in page.get("items") or []
+            ])
+        except Exception:
+            # Неуспешна проверка → счита се за проблем
             return "error"
-        if all_ready:
+
+    result.update(zip(missing, map_concurrently(pods_fallback, missing)))
+    return result
+
+
+# Класификация на reason-ите от Flux/Helm: един C-level search вместо
+# няколко Python `any(k in reason ...)` цикъла на condition
+PROGRESS_REASON = re.compile(r"progress|reconcil|pending|wait|poll|retry", re.IGNORECASE)
+FAILED_REASON = re.compile(r"fail|degrad|error", re.IGNORECASE)
+FAILED_TYPES = frozenset({"failed", "degraded"})
+
+
+def helmrelease_state(hr: dict | None) -> str | None:
+    """
+    Статус по conditions на HelmRelease; None ако няма категоричен резултат
+    (тогава се гледат Pod-овете).
+    """
+    status = (hr or {}).get("status", {}) or {}
+    conditions = status.get("conditions", []) or []
+
+    # Едно минаване: първият Ready condition + дали някой condition е очевиден failure
+    # (InstallFailed/UpgradeFailed/ReconciliationFailed също минават през "fail")
+    ready = None
+    any_failed = False
+    for c in conditions:
+        ctype = (c.get("type") or "").lower()
+        if ctype == "ready" and ready is None:
+            ready = c
+        if not any_failed:
+            any_failed = ctype in FAILED_TYPES or FAILED_REASON.search(c.get("reason") or "") is not None
+
+    if ready:
+        cond_status = (ready.get("status") or "").lower()        # "True" / "False" / "Unknown"
+        # Хепи път
+        if cond_status == "true":
             return "running"
-        return "progressing"
+        if cond_status in {"false", "unknown"}:
+            # В процес (Flux често маркира Progressing/Reconciling като False/Unknown докато се вдига),
+            # или reason подсказва временно състояние (wait/poll/retry) → не е error
+            # reason: "ReconciliationSucceeded", "Progressing", "InstallFailed", ...
+            if PROGRESS_REASON.search(ready.get("reason") or ""):
+                return "progressing"
+            # Всичко друго с False/Unknown → вероятно проблем
+            return "error"
 
-    except Exception:
-        # Неуспешна проверка → счита се за проблем
+    # Ако няма Ready condition, погледни други сигнали
+    if any_failed:
         return "error"
 
+    # Ако има status.conditions, но нищо категорично → progressing
+    if conditions:
+        return "progressing"
 
-def _find_condition(conditions: list[dict], cond_type: str) -> dict | None:
-    for c in conditions:
-        if (c.get("type") or "").lower() == cond_type.lower():
-            return c
     return None
 
 
-def _any_failed_condition(conditions: list[dict]) -> bool:
+def helmrelease_version(hr: dict | None) -> str | None:
     """
-    Търси очевидни failure индикатори по reasons/types от Flux/Helm.
+    Версията (tag-ът на backend image-а) в spec-а на HelmRelease — последно приложената
+    от apply_helmrelease/apply_restaurant_helmrelease; None, ако я няма.
     """
-    for c in conditions or []:
-        status = (c.get("status") or "").lower()
-        reason = (c.get("reason") or "").lower()
-        ctype = (c.get("type") or "").lower()
-        if any(k in reason for k in ("fail", "degrad", "error")):
-            return True
-        if ctype in {"failed", "degraded"}:
-            return True
-        if status == "false" and any(k in reason for k in ("installfailed", "upgradefailed", "reconciliationfailed")):
-            return True
-    return False
+    values = ((hr or {}).get("spec") or {}).get("values") or {}
+    return ((values.get("images") or {}).get("backend") or {}).get("tag")
+
+
+# Причини за waiting, които значат, че контейнерът няма да тръгне сам
+_POD_ERROR_REASONS = frozenset({
+    "CrashLoopBackOff",
+    "ErrImagePull",
+    "ImagePullBackOff",
+    "CreateContainerConfigError",
+    "CreateContainerError",
+})
+
+
+def pod_summary(pod: dict) -> tuple[tuple[str | None, bool], ...]:
+    """
+    Само това, което ни трябва от Pod (суров JSON): (waiting reason, ready) за
+    всеки контейнер. Празен tuple, ако Pod-ът още няма container statuses.
+    """
+    summary = []
+    for cs in (pod.get("status") or {}).get("containerStatuses") or []:
+        waiting = (cs.get("state") or {}).get("waiting") or {}
+        summary.append((waiting.get("reason"), bool(cs.get("ready"))))
+    return tuple(summary)
+
+
+def pods_state(summaries: list[tuple[tuple[str | None, bool], ...]]) -> str:
+    """Статус по container statuses на Pod-овете в namespace-а (виж pod_summary)."""
+    if not summaries:
+        return "progressing"
+
+    any_error = False
+    all_ready = True
+
+    for cstatuses in summaries:
+        if not cstatuses:
+            all_ready = False
+            continue
+        for waiting_reason, ready in cstatuses:
+            # Грешки при стартиране/имиджи
+            if waiting_reason in _POD_ERROR_REASONS:
+                any_error = True
+            # Не е готов
+            if not ready:
+                all_ready = False
+
+    if any_error:
+        return "error"
+    if all_ready:
+        return "running"
+    return "progressing"
 
 
 # --- NEW: HelmRelease за ресторант ---
@@ -197,21 +373,12 @@ def apply_restaurant_helmrelease(org_namespace: str, restaurant_name: str, backe
         "spec": {
             "interval": "5m",
             "releaseName": release_name,
-            "chart": {
-                "spec": {
-                    "chart": "charts/restaurant-stack",
-                    "sourceRef": {
-                        "kind": "GitRepository",
-                        "name": "restaurant-stack",
-                        "namespace": "flux-system",
-                    },
-                }
-            },
-            "install": {"remediation": {"retries": 3}},
-            "upgrade": {"remediation": {"retries": 3}},
+            "chart": _RESTAURANT_CHART,
+            "install": _REMEDIATION,
+            "upgrade": _REMEDIATION,
             "values": {
                 "restaurantName": restaurant_name,
-                "ingress": {"baseDomain": settings.BASE_DOMAIN},
+                "ingress": _INGRESS,
                 "images": {
                     "backend":  {"repository": "ghcr.io/zdravkobonev/restaurant-be", "tag": backend_tag},
                     "frontend": {"repository": "ghcr.io/zdravkobonev/restaurant-fe", "tag": frontend_tag},
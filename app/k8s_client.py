@@ -1,15 +1,32 @@
 # app/k8s_client.py
+from functools import lru_cache
+
+import urllib3
 from kubernetes import client, config
 from .config import settings
 
+@lru_cache(maxsize=1)
 def get_clients():
+    # kubeconfig-ът се чете веднъж на процес; всички заявки ползват един ApiClient
+    # (и неговия connection pool → keep-alive към API сървъра, без нов TLS handshake).
     # ако имаш settings.KUBECONFIG (примерно в прод) → ползва него;
     # иначе локално чете ~/.kube/config (minikube)
+    configuration = client.Configuration()
     if settings.KUBECONFIG:
-        config.load_kube_config(config_file=settings.KUBECONFIG)
+        config.load_kube_config(config_file=settings.KUBECONFIG, client_configuration=configuration)
     else:
-        config.load_kube_config()
+        config.load_kube_config(client_configuration=configuration)
+
+    # по подразбиране pool-ът е малък → при паралелни заявки връзките се отварят/затварят
+    configuration.connection_pool_maxsize = settings.K8S_POOL_MAXSIZE
+    # кратък retry само за временни грешки на API сървъра/load balancer-а
+    # (urllib3 не retry-ва POST/PATCH по status); raise_on_status=False → накрая
+    # пак получаваме обичайния ApiException, а не MaxRetryError
+    configuration.retries = urllib3.Retry(
+        total=2, backoff_factor=0.1, status_forcelist=[502, 503, 504], raise_on_status=False
+    )
 
-    core = client.CoreV1Api()       # namespaces, pods, services...
-    crd = client.CustomObjectsApi() # Flux HelmRelease (CRD)
+    api_client = client.ApiClient(configuration)
+    core = client.CoreV1Api(api_client)       # namespaces, pods, services...
+    crd = client.CustomObjectsApi(api_client) # Flux HelmRelease (CRD)
     return core, crd
@@ -1,15 +1,18 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-
-import app
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
 
 from .db import engine, Base
+from .pagination import NEXT_CURSOR_HEADER
+from . import cluster_watch, status_sync
 from .routers import auth
 from .routers import organizations
 from .routers import restaurants
 
 def create_app() -> FastAPI:
-    app = FastAPI(title="Admin Login API", version="1.0.0")
+    # orjson сериализира отговорите (списъците с datetime/enum полета) в C вместо json.dumps
+    app = FastAPI(title="Admin Login API", version="1.0.0", default_response_class=ORJSONResponse)
 
     origins = [
         "http://localhost:5173",
@@ -20,16 +23,32 @@ def create_app() -> FastAPI:
         CORSMiddleware,
         allow_origins=origins,
         allow_credentials=True,              # ако някой ден пращаш cookies
-        allow_methods=["*"],                 # GET, POST, PATCH, DELETE, OPTIONS...
-        allow_headers=["*"],                 # Authorization, Content-Type, и т.н.
-        expose_headers=["*"],                # по избор
+        allow_methods=["GET", "POST", "PATCH", "DELETE", "OPTIONS"],
+        allow_headers=["authorization", "content-type"],   # само реално ползваните; без "*" (echo на headers при всеки preflight)
+        expose_headers=[NEXT_CURSOR_HEADER],   # курсорът за следващата страница на list ендпойнтите
+        max_age=86400,                       # браузърът кешира preflight-а (до колкото позволява) → без OPTIONS преди всяка заявка
     )
 
+    # JSON списъците (до 200 реда) се компресират; малките отговори — не (не си струва CPU-то)
+    app.add_middleware(GZipMiddleware, minimum_size=1024)
+
     app.include_router(auth.router)
     app.include_router(organizations.router)
 
     app.include_router(restaurants.router)
 
+    @app.on_event("startup")
+    def start_background_sync():
+        # статусите на организациите се следят с watch, не с polling при всяка заявка
+        cluster_watch.start()
+        # статусите в БД се сверяват с кластера във фонова нишка, не в GET заявките
+        status_sync.start()
+
+    @app.on_event("shutdown")
+    def stop_background_sync():
+        status_sync.stop()
+        cluster_watch.stop()
+
     @app.get("/health")
     def health():
         return {"status": "ok"}
@@ -1,6 +1,6 @@
 from datetime import datetime
 from typing import Optional
-from sqlalchemy import CheckConstraint, Integer, String, DateTime, func, Enum, Boolean, ForeignKey, UniqueConstraint, Index
+from sqlalchemy import CheckConstraint, Integer, String, DateTime, func, Enum, Boolean, ForeignKey, UniqueConstraint, Index, text
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from .db import Base
 import enum
@@ -66,6 +66,9 @@ class Organization(Base):
             r"version ~ '^(0|[1-9]\d*)\.(0|[1-9]\d*)\.(0|[1-9]\d*)$'",
             name="ck_organizations_version_semver",
         ),
+        # partial index за list-а (само активните, подредени по id);
+        # заявката трябва да филтрира с NOT is_deleted / = false, не с IS false
+        Index("ix_organizations_active_id", "id", postgresql_where=text("is_deleted = false")),
     )
 
 class Restaurant(Base):
@@ -110,17 +113,22 @@ class Restaurant(Base):
         DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now()
     )
 
-    # релация към Organization
+    # релация към Organization; зарежда се lazy само при нужда (напр. update_restaurant
+    # за namespace-а); list-овете не я зареждат, а status sync-ът JOIN-ва Organization директно
     organization: Mapped["Organization"] = relationship(
         "Organization",
         backref="restaurants",
-        lazy="joined",
+        lazy="select",
     )
 
     # уникалност на името в рамките на една организация + semver check
     __table_args__ = (
         UniqueConstraint("organization_id", "name", name="uq_restaurant_org_name"),
         Index("ix_restaurants_org_active", "organization_id", "is_deleted"),
+        # list_restaurants по подразбиране: активни, по организация, подредени по id
+        Index("ix_restaurants_active_org_id", "organization_id", "id", postgresql_where=text("is_deleted = false")),
+        # търсене по име (ILIKE '%q%') без seq scan; изисква pg_trgm
+        Index("ix_restaurants_name_trgm", "name", postgresql_using="gin", postgresql_ops={"name": "gin_trgm_ops"}),
         CheckConstraint(
             r"version ~ '^(0|[1-9]\d*)\.(0|[1-9]\d*)\.(0|[1-9]\d*)$'",
             name="ck_restaurants_version_semver",
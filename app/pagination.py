@@ -0,0 +1,32 @@
+# app/pagination.py
+"""
+Keyset (cursor) пагинация за list ендпойнтите.
+
+Вместо OFFSET (Postgres пак чете и изхвърля skip реда) следващата страница
+започва след id-то на последния върнат ред: WHERE id > :last_id ORDER BY id.
+Курсорът е непрозрачен за клиента (base64) и идва в X-Next-Cursor header-а.
+"""
+import base64
+import binascii
+
+from fastapi import HTTPException, Response, status
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(last_id: int) -> str:
+    return base64.urlsafe_b64encode(str(last_id).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> int:
+    """id на последния ред от предишната страница; 400 при невалиден курсор."""
+    try:
+        return int(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor.")
+
+
+def set_next_cursor(response: Response, rows: list, limit: int):
+    """Ако страницата е пълна, може да има следваща → курсор към нея в header-а."""
+    if len(rows) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(rows[-1].id)
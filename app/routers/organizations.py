@@ -1,22 +1,26 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+import logging
+import re
+
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Response, status, Query
 from sqlalchemy.orm import Session
-from sqlalchemy import select
+from sqlalchemy import select, update
 from sqlalchemy.exc import IntegrityError
 
 from ..dependencies import get_current_user
-from ..db import get_db
+from ..pagination import decode_cursor, set_next_cursor
+from ..db import get_db, SessionLocal
 from ..models import Organization, OrgStatus, Admin
-from ..schemas import OrganizationOut, OrganizationCreate, OrganizationUpdate
+from ..schemas import OrganizationListOut, OrganizationOut, OrganizationCreate, OrganizationUpdate
 
-from app.flux_provisioner import ensure_namespace, apply_helmrelease
-# NEW: ще опитаме да използваме helper, ако съществува
-try:
-    from app.flux_provisioner import get_org_status  # очаква str: "running" | "progressing" | "error"
-except Exception:
-    get_org_status = None  # ще fallback-нем по-долу
+from app.flux_provisioner import provision_organizations
 
 router = APIRouter(prefix="/organizations", tags=["organizations"])
 
+log = logging.getLogger(__name__)
+
+
+_WHITESPACE = re.compile(r"\s+")
+
 
 def _normalize_name(name: str) -> str:
         """Normalize a provided name: strip, replace whitespace with '-', and lowercase.
@@ -25,28 +29,30 @@ def _normalize_name(name: str) -> str:
             'Acme Corp' -> 'acme-corp'
             '  Foo Bar ' -> 'foo-bar'
         """
-        import re
         if not name:
                 return name
-        return re.sub(r"\s+", "-", name.strip()).lower()
+        return _WHITESPACE.sub("-", name.strip()).lower()
 
 
-def _map_cluster_state_to_org_status(cluster_state: str) -> OrgStatus:
+def _provision_organizations(items: list[tuple[int, str, str, str]]):
     """
-    Преобразува състояние от кластера към OrgStatus.
-    running      -> active
-    progressing  -> pending
-    error        -> error
-    other        -> suspended
+    Вдига/обновява организациите в кластера (namespace + HelmRelease), паралелно.
+    items: (org_id, name, backend_tag, frontend_tag).
+    Пуска се като BackgroundTask след отговора, затова ползва собствена сесия;
+    при провал → статус error (app.status_sync после ще го синхронизира с кластера).
     """
-    s = (cluster_state or "").lower()
-    if s == "running":
-        return OrgStatus.active
-    if s == "progressing":
-        return OrgStatus.pending
-    if s == "error":
-        return OrgStatus.error
-    return OrgStatus.suspended
+    errors = provision_organizations([(name, be, fe) for _, name, be, fe in items])
+    if not errors:
+        return
+
+    for name, e in errors.items():
+        log.error("Failed provisioning organization %s in cluster: %s", name, e)
+    with SessionLocal() as db:
+        db.execute(
+            update(Organization),
+            [{"id": org_id, "status": OrgStatus.error} for org_id, name, _, _ in items if name in errors],
+        )
+        db.commit()
 
 
 @router.get("", response_model=list[OrganizationOut])
@@ -55,48 +61,28 @@ def list_organizations(
     current_user: Admin = Depends(get_current_user),
     skip: int = Query(0, ge=0),
     limit: int = Query(50, ge=1, le=200),
+    cursor: str | None = Query(None, description="X-Next-Cursor от предишната страница (вместо skip)"),
 ):
-    rows = db.scalars(
-        select(Organization)
-        .where(Organization.is_deleted.is_(False))
-        .offset(skip)
-        .limit(limit)
-    ).all()
-
-    # Ако имаме функция за проверка на статуса в кластера — синхронизираме.
-    updated = False
-    for org in rows:
-        # защитно: прескачаме ако няма име
-        if not org.name:
-            continue
-
-        try:
-            if get_org_status is None:
-                # Нямаме имплементация: НЕ променяме статуса, само връщаме каквото е в БД.
-                continue
-
-            cluster_state = get_org_status(org.name)  # "running" | "progressing" | "error"
-            new_status = _map_cluster_state_to_org_status(cluster_state)
-
-        except Exception:
-            # Ако проверката фейлне, маркираме като suspended (по-неутрално от error тук)
-            new_status = OrgStatus.suspended
-
-        if new_status != org.status:
-            org.status = new_status
-            db.add(org)
-            updated = True
-
-    if updated:
-        db.commit()
-        # не е нужно refresh на всеки ред — вече са в паметта с новия статус
-
-    return rows
+    # Само чете: статусите в БД се синхронизират с кластера от app.status_sync
+    stmt = select(Organization).where(~Organization.is_deleted)  # NOT is_deleted → ползва ix_organizations_active_id
+    if cursor is not None:
+        # keyset: след последния ред от предишната страница, без OFFSET
+        stmt = stmt.where(Organization.id > decode_cursor(cursor))
+    else:
+        stmt = stmt.offset(skip)
+    rows = db.scalars(stmt.order_by(Organization.id).limit(limit)).all()
+
+    # response_model остава за OpenAPI; отговорът се строи директно (един проход
+    # в pydantic-core за целия списък), FastAPI не го валидира втори път
+    response = Response(OrganizationListOut.dump_json(OrganizationListOut.validate_python(rows)), media_type="application/json")
+    set_next_cursor(response, rows, limit)
+    return response
 
 
 @router.post("", response_model=OrganizationOut, status_code=status.HTTP_201_CREATED)
 def create_organization(
     payload: OrganizationCreate,
+    background_tasks: BackgroundTasks,
     current_user: Admin = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -118,26 +104,62 @@ def create_organization(
         )
     db.refresh(org)
 
-    # Използваме реалната версия от БД за таговете
+    # Използваме реалната версия от БД за таговете.
+    # Provisioning-ът в кластера е след отговора — клиентът получава 201 (pending) веднага;
+    # ако се провали, статусът става error.
     be_tag = org.version
     fe_tag = org.version
+    background_tasks.add_task(_provision_organizations, [(org.id, org.name, be_tag, fe_tag)])
+
+    return org
+
+
+@router.post("/bulk", response_model=list[OrganizationOut], status_code=status.HTTP_201_CREATED)
+def create_organizations_bulk(
+    payload: list[OrganizationCreate],
+    background_tasks: BackgroundTasks,
+    current_user: Admin = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Създава няколко организации наведнъж (onboarding); provisioning-ът им върви паралелно."""
+    orgs = [
+        Organization(
+            name=_normalize_name(p.name),
+            version=p.version if p.version is not None else "1.0.0",
+            status=p.status if p.status is not None else OrgStatus.pending,
+        )
+        for p in payload
+    ]
+    db.add_all(orgs)
     try:
-        ensure_namespace(org.name)
-        apply_helmrelease(org.name, be_tag, fe_tag)
-    except Exception as e:
-        # ако provisioning-ът се провали → статус error
-        org.status = OrgStatus.error
-        db.add(org)
+        db.flush()
+        items = [(org.id, org.name, org.version, org.version) for org in orgs]
         db.commit()
-        raise HTTPException(500, f"Failed provisioning in cluster: {e}")
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="One or more organizations with these names already exist.",
+        )
 
-    return org
+    # един SELECT за всички нови редове вместо refresh на всеки поотделно
+    ids = [org_id for org_id, _, _, _ in items]
+    orgs = db.scalars(select(Organization).where(Organization.id.in_(ids)).order_by(Organization.id)).all()
+
+    background_tasks.add_task(_provision_organizations, items)
+    # както в list_organizations: целият списък в един проход в pydantic-core
+    return Response(
+        OrganizationListOut.dump_json(OrganizationListOut.validate_python(orgs)),
+        status_code=status.HTTP_201_CREATED,
+        media_type="application/json",
+    )
 
 
 @router.patch("/{org_id}", response_model=OrganizationOut)
 def update_organization(
     org_id: int,
     payload: OrganizationUpdate,
+    background_tasks: BackgroundTasks,
     current_user: Admin = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -161,9 +183,10 @@ def update_organization(
             detail="Organization status cannot be changed via this endpoint."
         )
 
-    # Разрешена промяна: само версията
+    # Разрешена промяна: само версията. При error (провален provisioning/rollout — sync-ът
+    # го пази, докато в кластера няма HelmRelease с тази версия) и същата версия е повторен опит.
     version_changed = False
-    if payload.version is not None and payload.version != org.version:
+    if payload.version is not None and (payload.version != org.version or org.status == OrgStatus.error):
         org.version = payload.version
         org.status = OrgStatus.pending  # започва нов rollout
         version_changed = True
@@ -180,18 +203,12 @@ def update_organization(
         )
     db.refresh(org)
 
-    # Ако версията се смени — re-apply HelmRelease с новите тагове
+    # Ако версията се смени — re-apply HelmRelease с новите тагове (след отговора;
+    # при провал на rollout → error)
     if version_changed:
         be_tag = org.version
         fe_tag = org.version
-        try:
-            apply_helmrelease(org.name, be_tag, fe_tag)
-        except Exception as e:
-            # при провал на rollout → отбелязваме като error
-            org.status = OrgStatus.error
-            db.add(org)
-            db.commit()
-            raise HTTPException(500, f"Failed to roll out new version: {e}")
+        background_tasks.add_task(_provision_organizations, [(org.id, org.name, be_tag, fe_tag)])
 
     return org
 
@@ -202,15 +219,17 @@ def delete_organization(
     current_user: Admin = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    org = db.get(Organization, org_id)
-    if not org:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Organization not found.")
-    
-    if org.is_deleted:
+    # soft delete с един UPDATE (без SELECT + flush)
+    result = db.execute(
+        update(Organization)
+        .where(Organization.id == org_id, ~Organization.is_deleted)
+        .values(is_deleted=True, status=OrgStatus.deleted)
+    )
+    if result.rowcount == 0:
+        # нищо не е обновено: или няма такава, или вече е изтрита (идемпотентно → 204)
+        if db.scalar(select(Organization.id).where(Organization.id == org_id)) is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Organization not found.")
         return None
-    
-    org.is_deleted = True
-    org.status = OrgStatus.deleted
-    db.add(org)
+
     db.commit()
     return None
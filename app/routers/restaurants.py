@@ -1,30 +1,67 @@
 # routers/restaurants.py
+import logging
+import re
 
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Response, status, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import select, or_
+from sqlalchemy import select, or_, update
 from sqlalchemy.exc import IntegrityError
 
 from ..dependencies import get_current_user
-from ..db import get_db
+from ..pagination import decode_cursor, set_next_cursor
+from ..db import get_db, SessionLocal
 from ..models import Restaurant, RestaurantStatus, Organization, Admin
 from ..schemas import (
+    RestaurantListOut,
     RestaurantOut,
     RestaurantCreate,
     RestaurantUpdate,
 )
-from app.k8s_client import get_clients
-from kubernetes import client
 from app.flux_provisioner import apply_restaurant_helmrelease, ensure_namespace
 
 router = APIRouter(prefix="/restaurants", tags=["restaurants"])
 
+log = logging.getLogger(__name__)
+
+
+_WHITESPACE = re.compile(r"\s+")
+
 
 def _normalize_name(name: str) -> str:
-    import re
     if not name:
         return name
-    return re.sub(r"\s+", "-", name.strip()).lower()
+    return _WHITESPACE.sub("-", name.strip()).lower()
+
+
+def _provision_restaurant(
+    restaurant_id: int,
+    org_namespace: str,
+    name: str,
+    backend_tag: str,
+    frontend_tag: str,
+    ensure_ns: bool = True,
+):
+    """
+    Вдига/обновява HelmRelease-а на ресторанта в namespace-а на организацията.
+    Пуска се като BackgroundTask след отговора, затова ползва собствена сесия;
+    при провал → статус error с директен UPDATE (app.status_sync после ще го синхронизира с кластера).
+    """
+    try:
+        if ensure_ns:
+            # гарантираме, че namespace-а съществува (създаден при организацията, но безопасно е да повикаме)
+            ensure_namespace(org_namespace)
+        apply_restaurant_helmrelease(org_namespace, name, backend_tag, frontend_tag)
+    except Exception:
+        log.exception("Failed provisioning restaurant %s in namespace %s", name, org_namespace)
+        with SessionLocal() as db:
+            db.execute(
+                update(Restaurant)
+                .where(Restaurant.id == restaurant_id)
+                .values(status=RestaurantStatus.error)
+            )
+            db.commit()
+
 
 @router.get("", response_model=list[RestaurantOut])
 def list_restaurants(
@@ -32,131 +69,61 @@ def list_restaurants(
     current_user: Admin = Depends(get_current_user),
     skip: int = Query(0, ge=0),
     limit: int = Query(50, ge=1, le=200),
+    cursor: str | None = Query(None, description="X-Next-Cursor от предишната страница (вместо skip)"),
     organization_id: int | None = Query(None),
     include_deleted: bool = Query(False),
     q: str | None = Query(None, description="Търсене по име (substring)"),
     status_in: list[RestaurantStatus] | None = Query(None),
 ):
+    # Само чете: статусите в БД се синхронизират с кластера от app.status_sync
     stmt = select(Restaurant)
     if not include_deleted:
-        stmt = stmt.where(Restaurant.is_deleted.is_(False))
+        stmt = stmt.where(~Restaurant.is_deleted)  # NOT is_deleted → ползва частичния индекс
     if organization_id is not None:
         stmt = stmt.where(Restaurant.organization_id == organization_id)
     if q:
         stmt = stmt.where(Restaurant.name.ilike(f"%{q}%"))
     if status_in:
         stmt = stmt.where(Restaurant.status.in_(status_in))
-    rows = db.scalars(stmt.offset(skip).limit(limit)).all()
-
-    # Ако имаме възможност за проверка в кластера — синхронизиране на статуса
-    updated = False
-    for r in rows:
-        # защитно: прескачаме ако няма име или няма организация (трябва да има FK)
-        if not r.name or not r.organization:
-            continue
-
-        release_name = f"restaurant-{r.name}"
-        org_ns = r.organization.name
-
-        try:
-            core, crd = get_clients()
-
-            # 1) Опитай HelmRelease (Flux v2)
-            try:
-                hr = crd.get_namespaced_custom_object(
-                    group="helm.toolkit.fluxcd.io",
-                    version="v2",
-                    namespace=org_ns,
-                    plural="helmreleases",
-                    name=release_name,
-                )
-                status = (hr or {}).get("status", {}) or {}
-                conditions = status.get("conditions", []) or []
-
-                # намери Ready condition
-                ready = None
-                for c in conditions:
-                    if (c.get("type") or "").lower() == "ready":
-                        ready = c
-                        break
-
-                if ready:
-                    cond_status = (ready.get("status") or "").lower()
-                    reason = (ready.get("reason") or "").lower()
-                    if cond_status == "true":
-                        new_state = RestaurantStatus.active
-                    elif cond_status in {"false", "unknown"} and any(k in reason for k in ("progress", "reconcil", "pending")):
-                        new_state = RestaurantStatus.pending
-                    elif cond_status in {"false", "unknown"}:
-                        if any(k in reason for k in ("wait", "poll", "retry")):
-                            new_state = RestaurantStatus.pending
-                        else:
-                            new_state = RestaurantStatus.error
-                else:
-                    # без Ready condition — ако има очевидни failed indicators
-                    any_failed = False
-                    for c in conditions or []:
-                        st = (c.get("status") or "").lower()
-                        reason = (c.get("reason") or "").lower()
-                        ctype = (c.get("type") or "").lower()
-                        if any(k in reason for k in ("fail", "degrad", "error")) or ctype in {"failed", "degraded"}:
-                            any_failed = True
-                            break
-                    new_state = RestaurantStatus.error if any_failed else RestaurantStatus.pending
-
-            except client.ApiException:
-                # HelmRelease не е наличен/чете се — fallback към pod проверка
-                hr = None
-
-            # 2) Fallback: проверка на Pod-ове само ако няма категоричен резултат от HelmRelease
-            if hr is None:
-                try:
-                    pods = (core.list_namespaced_pod(namespace=org_ns).items) or []
-                    if not pods:
-                        new_state = RestaurantStatus.pending
-                    else:
-                        any_error = False
-                        all_ready = True
-                        for p in pods:
-                            cstatuses = p.status.container_statuses or []
-                            if not cstatuses:
-                                all_ready = False
-                                continue
-                            for cs in cstatuses:
-                                st = cs.state
-                                if st and st.waiting and st.waiting.reason in {
-                                    "CrashLoopBackOff",
-                                    "ErrImagePull",
-                                    "ImagePullBackOff",
-                                    "CreateContainerConfigError",
-                                    "CreateContainerError",
-                                }:
-                                    any_error = True
-                                if not cs.ready:
-                                    all_ready = False
-
-                        if any_error:
-                            new_state = RestaurantStatus.error
-                        elif all_ready:
-                            new_state = RestaurantStatus.active
-                        else:
-                            new_state = RestaurantStatus.pending
-                except Exception:
-                    new_state = RestaurantStatus.error
-
-        except Exception:
-            # Ако въобще не можем да проверим — пропускаме
-            continue
-
-        if new_state != r.status:
-            r.status = new_state
-            db.add(r)
-            updated = True
-
-    if updated:
-        db.commit()
+    if cursor is not None:
+        # keyset: след последния ред от предишната страница, без OFFSET
+        stmt = stmt.where(Restaurant.id > decode_cursor(cursor))
+    else:
+        stmt = stmt.offset(skip)
+    rows = db.scalars(stmt.order_by(Restaurant.id).limit(limit)).all()
+
+    # response_model остава за OpenAPI; отговорът се строи директно (един проход
+    # в pydantic-core за целия списък), FastAPI не го валидира втори път
+    response = Response(RestaurantListOut.dump_json(RestaurantListOut.validate_python(rows)), media_type="application/json")
+    set_next_cursor(response, rows, limit)
+    return response
+
+
+@router.get("/export", response_class=StreamingResponse)
+def export_restaurants(
+    current_user: Admin = Depends(get_current_user),
+    organization_id: int | None = Query(None),
+    include_deleted: bool = Query(False),
+):
+    """
+    Всички ресторанти като NDJSON (по един JSON на ред), без пагинация.
+    Редовете се четат със server-side cursor на порции и се пишат веднага →
+    паметта не расте с броя редове и първите байтове тръгват преди последния ред от БД.
+    """
+    stmt = select(Restaurant)
+    if not include_deleted:
+        stmt = stmt.where(~Restaurant.is_deleted)
+    if organization_id is not None:
+        stmt = stmt.where(Restaurant.organization_id == organization_id)
+    stmt = stmt.order_by(Restaurant.id).execution_options(yield_per=500)
+
+    def iter_ndjson():
+        # собствена сесия: тази от get_db се затваря преди да започне стриймът
+        with SessionLocal() as db:
+            for r in db.scalars(stmt):
+                yield RestaurantOut.model_validate(r).model_dump_json() + "\n"
 
-    return rows
+    return StreamingResponse(iter_ndjson(), media_type="application/x-ndjson")
 
 
 @router.get("/{restaurant_id}", response_model=RestaurantOut)
@@ -174,6 +141,7 @@ def get_restaurant(
 @router.post("", response_model=RestaurantOut, status_code=status.HTTP_201_CREATED)
 def create_restaurant(
     payload: RestaurantCreate,
+    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
     current_user: Admin = Depends(get_current_user),
 ):
@@ -203,15 +171,9 @@ def create_restaurant(
     org_namespace = org.name  # винаги namespace = organization.name
     # използваме реалната, записана версия на ресторанта за таговете
     backend_tag = frontend_tag = r.version
-    try:
-        # гарантираме, че namespace-а съществува (създаден при организацията, но безопасно е да повикаме)
-        ensure_namespace(org_namespace)
-        apply_restaurant_helmrelease(org_namespace, r.name, backend_tag, frontend_tag)
-    except Exception as e:
-        r.status = RestaurantStatus.error
-        db.add(r)
-        db.commit()
-        raise HTTPException(500, f"Failed provisioning restaurant in cluster: {e}")
+    # Provisioning-ът в кластера е след отговора — клиентът получава 201 (pending) веднага;
+    # ако се провали, статусът става error.
+    background_tasks.add_task(_provision_restaurant, r.id, org_namespace, r.name, backend_tag, frontend_tag)
 
     return r
 
@@ -220,6 +182,7 @@ def create_restaurant(
 def update_restaurant(
     restaurant_id: int,
     payload: RestaurantUpdate,
+    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
     current_user: Admin = Depends(get_current_user),
 ):
@@ -234,7 +197,10 @@ def update_restaurant(
         r.name = _normalize_name(payload.name)
     # Разрешаваме промяна само на status и version
     version_changed = False
-    if hasattr(payload, 'version') and payload.version is not None and payload.version != r.version:
+    # при error (провален provisioning/rollout — sync-ът го пази, докато в кластера няма
+    # HelmRelease с тази версия) и същата версия е повторен опит
+    retry = r.status == RestaurantStatus.error
+    if hasattr(payload, 'version') and payload.version is not None and (payload.version != r.version or retry):
         # при смяна на версия — отбелязваме, че започва нов rollout
         r.version = payload.version
         r.status = RestaurantStatus.pending
@@ -253,15 +219,11 @@ def update_restaurant(
         )
     db.refresh(r)
 
-    # Ако версията се смени — re-apply HelmRelease с новите тагове
+    # Ако версията се смени — re-apply HelmRelease с новите тагове (след отговора)
     if version_changed:
-        try:
-            apply_restaurant_helmrelease(r.organization.name, r.name, r.version, r.version)
-        except Exception as e:
-            r.status = RestaurantStatus.error
-            db.add(r)
-            db.commit()
-            raise HTTPException(500, f"Failed to roll out new restaurant version: {e}")
+        background_tasks.add_task(
+            _provision_restaurant, r.id, r.organization.name, r.name, r.version, r.version, ensure_ns=retry
+        )
     return r
 
 
@@ -271,13 +233,17 @@ def delete_restaurant(
     db: Session = Depends(get_db),
     current_user: Admin = Depends(get_current_user),
 ):
-    r = db.get(Restaurant, restaurant_id)
-    if not r:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Restaurant not found.")
-    if r.is_deleted:
+    # soft delete с един UPDATE (без SELECT + flush)
+    result = db.execute(
+        update(Restaurant)
+        .where(Restaurant.id == restaurant_id, ~Restaurant.is_deleted)
+        .values(is_deleted=True, status=RestaurantStatus.deleted)
+    )
+    if result.rowcount == 0:
+        # нищо не е обновено: или няма такъв, или вече е изтрит (идемпотентно → 204)
+        if db.scalar(select(Restaurant.id).where(Restaurant.id == restaurant_id)) is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Restaurant not found.")
         return None
-    r.is_deleted = True
-    r.status = RestaurantStatus.deleted
-    db.add(r)
+
     db.commit()
     return None
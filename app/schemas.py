@@ -1,17 +1,29 @@
-from pydantic import BaseModel, Field
+from pydantic import AfterValidator, BaseModel, ConfigDict, Field, TypeAdapter
 from typing import Optional, Annotated
 from datetime import datetime
 from .models import OrgStatus 
 from .models import RestaurantStatus
 
 
-SemVer = Annotated[
-    str,
-    Field(
-        pattern=r"^(0|[1-9]\d*)\.(0|[1-9]\d*)\.(0|[1-9]\d*)$",
-        examples=["1.0.0"],
-    ),
-]
+def _check_semver(v: str) -> str:
+    """MAJOR.MINOR.PATCH, без водещи нули — с split/isdigit вместо regex (версията винаги е кратка)."""
+    parts = v.split(".")
+    if len(parts) != 3 or not all(p.isascii() and p.isdigit() and (p == "0" or p[0] != "0") for p in parts):
+        raise ValueError("Version must be in SemVer format MAJOR.MINOR.PATCH (e.g. 1.0.0).")
+    return v
+
+
+_SEMVER_FIELD = Field(
+    examples=["1.0.0"],
+    # само за OpenAPI схемата; валидацията е в _check_semver
+    json_schema_extra={"pattern": r"^(0|[1-9]\d*)\.(0|[1-9]\d*)\.(0|[1-9]\d*)$"},
+)
+
+SemVer = Annotated[str, AfterValidator(_check_semver), _SEMVER_FIELD]
+
+# За отговорите: версията идва от БД, където вече е проверена (CHECK ck_*_version_semver)
+# → същата схема, без повторно пускане на валидатора за всеки ред
+StoredSemVer = Annotated[str, _SEMVER_FIELD]
 
 class LoginIn(BaseModel):
     username: str = Field(min_length=3, max_length=150)
@@ -33,15 +45,14 @@ class OrganizationUpdate(OrganizationBase):
     pass  # всичко е опционално (PATCH)
 
 class OrganizationOut(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
     id: int
     name: str
-    version: SemVer
+    version: StoredSemVer
     status: OrgStatus
     created_at: datetime
 
-    class Config:
-        from_attributes = True
-
 
 class RestaurantBase(BaseModel):
     name: str = Field(..., max_length=255)
@@ -61,14 +72,19 @@ class RestaurantUpdate(BaseModel):
     version: Optional[SemVer] = None
 
 class RestaurantOut(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
     id: int
     name: str
     organization_id: int
-    version: SemVer
+    version: StoredSemVer
     status: RestaurantStatus
     is_deleted: bool
     created_at: datetime
     updated_at: datetime
 
-    class Config:
-        from_attributes = True
\ No newline at end of file
+
+# За list ендпойнтите: валидация + JSON на целия списък наведнъж в pydantic-core,
+# вместо FastAPI да обработва всеки елемент поотделно
+OrganizationListOut = TypeAdapter(list[OrganizationOut])
+RestaurantListOut = TypeAdapter(list[RestaurantOut])
@@ -0,0 +1,403 @@
+# app/status_sync.py
+"""
+Синхронизация на статусите на организациите и ресторантите с кластера.
+
+Една фонова нишка сверява статусите в БД с HelmRelease-ите/Pod-овете и записва
+само разликите; list ендпойнтите само четат от БД и не чакат Kubernetes.
+Нишката се събужда от app.cluster_watch при всяка промяна в кластера (и чете
+от неговата памет, без заявки към API сървъра); на всеки
+STATUS_SYNC_INTERVAL_SECONDS минава и без промяна — за случая, в който watch-ът не работи.
+"""
+import logging
+import threading
+
+from kubernetes import client
+from sqlalchemy import Integer, cast, column, select, update, values
+
+from . import cluster_watch
+from .cluster_watch import (
+    watched_namespace_helmreleases,
+    watched_org_statuses,
+    watched_pod_states,
+    watched_release_versions,
+)
+from .config import settings
+from .db import SessionLocal
+from .flux_provisioner import (
+    FAILED_REASON,
+    FAILED_TYPES,
+    PROGRESS_REASON,
+    get_all_org_statuses,
+    helmrelease_version,
+    list_pages,
+    map_concurrently,
+    pod_summary,
+    pods_state,
+)
+from .k8s_client import get_clients
+from .models import Organization, OrgStatus, Restaurant, RestaurantStatus
+
+log = logging.getLogger(__name__)
+
+_stop = threading.Event()
+_thread: threading.Thread | None = None
+
+# след събуждане от watch-а изчакваме малко, за да съберем поредица от събития в една синхронизация
+_DEBOUNCE_SECONDS = 1
+
+
+def start():
+    """Пуска нишката за синхронизация (веднъж на процес)."""
+    global _thread
+    if _thread is not None and _thread.is_alive():
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_run, name="status-sync", daemon=True)
+    _thread.start()
+
+
+def stop():
+    _stop.set()
+
+
+def _run():
+    # първата синхронизация е веднага, после при промяна от watch-а или на всеки интервал
+    while True:
+        try:
+            sync_once()
+        except Exception:
+            log.exception("Status sync failed")
+        cluster_watch.wait_for_change(settings.STATUS_SYNC_INTERVAL_SECONDS)
+        if _stop.wait(_DEBOUNCE_SECONDS):
+            return
+
+
+def sync_once():
+    """Един пълен цикъл: организации, после ресторанти (всеки със собствен commit)."""
+    with SessionLocal() as db:
+        _sync_organizations(db)
+        _sync_restaurants(db)
+
+
+# редове на един UPDATE: 3 параметъра на ред, под лимита от 65535 на заявка
+_UPDATE_CHUNK_ROWS = 5000
+
+
+def _apply_statuses(db, model, new_statuses: list[tuple[int, object, object]]):
+    """
+    Записва (id, прочетен статус, нов статус) тройките с UPDATE ... FROM (VALUES ...)
+    на парчета по _UPDATE_CHUNK_ROWS; непроменените (нов == прочетен) изобщо не се пращат,
+    така че в обичайния случай няма заявка.
+    Ред, чийто статус междувременно е сменен (напр. error от провален provisioning
+    в BackgroundTask), не се пипа (guard по прочетения статус + IS DISTINCT FROM в SQL) —
+    следващата синхронизация ще го види.
+    """
+    changed = [(row_id, old, new) for row_id, old, new in new_statuses if new != old]
+    if not changed:
+        return
+    status_type = model.__table__.c.status.type
+    for start in range(0, len(changed), _UPDATE_CHUNK_ROWS):
+        v = values(
+            column("id", Integer), column("old_status", status_type), column("new_status", status_type), name="v"
+        ).data(changed[start:start + _UPDATE_CHUNK_ROWS])
+        # VALUES колоните идват като text → изричен cast към enum-а
+        new_status = cast(v.c.new_status, status_type)
+        db.execute(
+            update(model)
+            .where(
+                model.id == v.c.id,
+                model.status == cast(v.c.old_status, status_type),
+                model.status.is_distinct_from(new_status),
+            )
+            .values(status=new_status),
+            execution_options={"synchronize_session": False},
+        )
+    db.commit()
+
+
+def _release_versions(keys: list[tuple[str, str]]) -> dict[tuple[str, str], str | None]:
+    """
+    Версията в spec-а на HelmRelease-ите по (namespace, име) — от watch-а, иначе с GET
+    на всеки (паралелно); None, ако HelmRelease-ът липсва или не може да се прочете.
+    """
+    watched = watched_release_versions(keys)
+    if watched is not None:
+        return watched
+
+    _, crd = get_clients()
+
+    def fetch(key: tuple[str, str]) -> str | None:
+        ns, name = key
+        try:
+            return helmrelease_version(crd.get_namespaced_custom_object(
+                group="helm.toolkit.fluxcd.io",
+                version="v2",
+                namespace=ns,
+                plural="helmreleases",
+                name=name,
+            ))
+        except Exception:
+            return None
+
+    return dict(zip(keys, map_concurrently(fetch, keys)))
+
+
+def _failed_provisioning(errored: list[tuple[int, tuple[str, str], str]]) -> set[int]:
+    """
+    От редовете в error — (id, (namespace, HelmRelease), версия в БД) — тези, за които
+    в кластера няма HelmRelease с версията от БД: provisioning-ът/rollout-ът им е
+    гръмнал (BackgroundTask-ът ги е маркирал error). Тях sync-ът не пипа — иначе Pod-овете
+    или старият HelmRelease (още Ready на предишната версия) биха върнали статуса на
+    active/pending. error остава, докато HelmRelease-ът с тази версия не се появи.
+    """
+    if not errored:
+        return set()
+    try:
+        versions = _release_versions([key for _, key, _ in errored])
+    except Exception:
+        # не можем да проверим → оставяме ги в error
+        return {row_id for row_id, _, _ in errored}
+    return {row_id for row_id, key, version in errored if versions.get(key) != version}
+
+
+# --- Организации ---
+
+# Състояние от кластера (get_all_org_statuses / watch-а) → OrgStatus; всичко друго → suspended
+_CLUSTER_TO_ORG_STATUS = {
+    "running": OrgStatus.active,
+    "progressing": OrgStatus.pending,
+    "error": OrgStatus.error,
+}
+
+
+def _map_cluster_state_to_org_status(cluster_state: str | None) -> OrgStatus:
+    """
+    Преобразува състояние от кластера към OrgStatus.
+    running      -> active
+    progressing  -> pending
+    error        -> error
+    other        -> suspended
+    """
+    # flux_provisioner винаги връща малки букви → без .lower() на всеки ред
+    return _CLUSTER_TO_ORG_STATUS.get(cluster_state, OrgStatus.suspended)
+
+
+def _sync_organizations(db):
+    rows = db.execute(
+        select(Organization.id, Organization.name, Organization.status, Organization.version)
+        .where(~Organization.is_deleted)
+    ).all()
+    # четящата транзакция се затваря преди заявките към кластера (могат да отнемат секунди) —
+    # иначе connection-ът от pool-а стои "idle in transaction"; UPDATE-ът после отваря нова
+    db.rollback()
+    # защитно: прескачаме ако няма име
+    rows = [row for row in rows if row.name]
+
+    # error от провален provisioning/rollout остава до HelmRelease с версията от БД
+    failed = _failed_provisioning([
+        (row.id, (row.name, row.name), row.version) for row in rows if row.status == OrgStatus.error
+    ])
+    rows = [row for row in rows if row.id not in failed]
+
+    # Статусите идват от фоновия watch; кластера питаме (с една заявка за всички)
+    # само за организациите, които watch-ът още не познава.
+    names = [row.name for row in rows]
+    try:
+        cluster_states = watched_org_statuses(names)
+        missing = [name for name in names if name not in cluster_states]
+        if missing:
+            cluster_states.update(get_all_org_statuses(missing))
+    except Exception:
+        # Ако проверката фейлне, маркираме като suspended (по-неутрално от error тук)
+        cluster_states = None
+
+    _apply_statuses(db, Organization, [
+        (
+            row.id,
+            row.status,
+            OrgStatus.suspended if cluster_states is None
+            else _map_cluster_state_to_org_status(cluster_states.get(row.name)),  # "running" | "progressing" | "error"
+        )
+        for row in rows
+    ])
+
+
+# --- Ресторанти ---
+
+# HelmRelease-ът липсва/не се чете → статусът се определя по Pod-овете
+_NO_HELMRELEASE = object()
+
+
+def _cluster_statuses(core, crd, keys: set[tuple[str, str]]) -> dict[tuple[str, str], RestaurantStatus]:
+    """
+    Статусите от кластера за (namespace на организацията, release) двойките: по HelmRelease-а
+    на ресторанта (Flux v2), а ако него го няма — по Pod-овете в namespace-а.
+    Липсват тези, които въобще не можем да проверим.
+    """
+    watched = _watched_statuses(keys)
+    if watched is not None:
+        return watched
+
+    keys = list(keys)
+    if not keys:
+        return {}
+
+    # 1) HelmRelease-ите: по една list заявка на namespace (паралелно), не GET на ресторант
+    namespaces = list({ns for ns, _ in keys})
+    hrs_by_ns = dict(zip(namespaces, map_concurrently(lambda ns: _namespace_helmreleases(crd, ns), namespaces)))
+    hr_states = [_helmrelease_status(hrs_by_ns[ns], release_name) for ns, release_name in keys]
+
+    # 2) Fallback: Pod-овете се листват веднъж на namespace, не по веднъж на ресторант
+    namespaces = list({ns for (ns, _), st in zip(keys, hr_states) if st is _NO_HELMRELEASE})
+    pod_states = dict(zip(namespaces, map_concurrently(lambda ns: _pods_status(core, ns), namespaces)))
+
+    result = {}
+    for key, state in zip(keys, hr_states):
+        if state is _NO_HELMRELEASE:
+            state = pod_states[key[0]]
+        if state is not None:
+            result[key] = state
+    return result
+
+
+def _watched_statuses(keys: set[tuple[str, str]]) -> dict[tuple[str, str], RestaurantStatus] | None:
+    """Същото от паметта на watch-а (без заявки към кластера); None, ако watch-ът не е синхронизиран."""
+    namespaces = {ns for ns, _ in keys}
+    hrs_by_ns = watched_namespace_helmreleases(namespaces)
+    pod_states = watched_pod_states(namespaces)
+    if hrs_by_ns is None or pod_states is None:
+        return None
+
+    result = {}
+    for ns, release_name in keys:
+        state = _helmrelease_status(hrs_by_ns[ns], release_name)
+        if state is _NO_HELMRELEASE:
+            state = _POD_TO_RESTAURANT_STATUS[pod_states[ns]]
+        if state is not None:
+            result[(ns, release_name)] = state
+    return result
+
+
+def _namespace_helmreleases(crd, org_ns: str) -> dict[str, dict] | None:
+    """
+    HelmRelease-ите в namespace-а по име; {} ако не се четат (→ всички по Pod-овете),
+    None ако въобще не можем да проверим.
+    """
+    try:
+        return {
+            hr["metadata"]["name"]: hr
+            for page in list_pages(
+                crd.list_namespaced_custom_object,
+                group="helm.toolkit.fluxcd.io",
+                version="v2",
+                namespace=org_ns,
+                plural="helmreleases",
+            )
+            for hr in page.get("items") or []
+        }
+    except client.ApiException:
+        # HelmRelease-ите не са налични/четат се — fallback към pod проверка
+        return {}
+    except Exception:
+        return None
+
+
+def _helmrelease_status(helmreleases: dict[str, dict] | None, release_name: str):
+    """Статус по HelmRelease-а; _NO_HELMRELEASE, ако го няма; None, ако не можем да проверим."""
+    if helmreleases is None:
+        # Ако въобще не можем да проверим — пропускаме
+        return None
+    hr = helmreleases.get(release_name)
+    if hr is None:
+        return _NO_HELMRELEASE
+    try:
+        return _helmrelease_state(hr)
+    except Exception:
+        return None
+
+
+def _helmrelease_state(hr: dict) -> RestaurantStatus | None:
+    """Статус по conditions на HelmRelease-а; None при непознат статус на Ready."""
+    status = (hr or {}).get("status", {}) or {}
+    conditions = status.get("conditions", []) or []
+
+    # Едно минаване: първият Ready condition + дали има очевидни failed indicators
+    # (type/lower се взимат веднъж на condition)
+    ready = None
+    any_failed = False
+    for c in conditions:
+        ctype = (c.get("type") or "").lower()
+        if ctype == "ready":
+            if ready is None:
+                ready = c
+        elif not any_failed:
+            any_failed = ctype in FAILED_TYPES or FAILED_REASON.search(c.get("reason") or "") is not None
+
+    if ready:
+        cond_status = (ready.get("status") or "").lower()
+        if cond_status == "true":
+            return RestaurantStatus.active
+        if cond_status in {"false", "unknown"}:
+            # едно сканиране на reason с прекомпилиран regex вместо шест `in` проверки
+            if PROGRESS_REASON.search(ready.get("reason") or ""):
+                return RestaurantStatus.pending
+            return RestaurantStatus.error
+        return None
+
+    # без Ready condition — ако има очевидни failed indicators
+    return RestaurantStatus.error if any_failed else RestaurantStatus.pending
+
+
+# pods_state (от watch-а или от list на Pod-овете) → RestaurantStatus
+_POD_TO_RESTAURANT_STATUS = {
+    "running": RestaurantStatus.active,
+    "progressing": RestaurantStatus.pending,
+    "error": RestaurantStatus.error,
+}
+
+
+def _pods_status(core, org_ns: str) -> RestaurantStatus:
+    """Статус по Pod-овете в namespace-а на организацията."""
+    try:
+        summaries = [
+            pod_summary(p)
+            for page in list_pages(core.list_namespaced_pod, namespace=org_ns)
+            for p in page.get("items") or []
+        ]
+        return _POD_TO_RESTAURANT_STATUS[pods_state(summaries)]
+    except Exception:
+        return RestaurantStatus.error
+
+
+def _sync_restaurants(db):
+    rows = db.execute(
+        select(
+            Restaurant.id, Restaurant.name, Restaurant.status, Restaurant.version,
+            Organization.name.label("org_ns"),
+        )
+        .join(Organization, Restaurant.organization_id == Organization.id)
+        .where(~Restaurant.is_deleted)
+    ).all()
+    # както при организациите: без отворена транзакция докато питаме кластера
+    db.rollback()
+
+    try:
+        core, crd = get_clients()
+    except Exception:
+        # Ако въобще не можем да се свържем с кластера — оставяме записаните статуси
+        return
+
+    # защитно: прескачаме ако няма име или няма организация (трябва да има FK)
+    rows = [row for row in rows if row.name and row.org_ns]
+    keys = {row.id: (row.org_ns, f"restaurant-{row.name}") for row in rows}
+
+    # error от провален provisioning/rollout остава до HelmRelease с версията от БД — и по
+    # watch-а, и по API-то (без него Pod-овете/старият Ready HelmRelease биха го изтрили)
+    failed = _failed_provisioning([
+        (row.id, keys[row.id], row.version) for row in rows if row.status == RestaurantStatus.error
+    ])
+    rows = [row for row in rows if row.id not in failed]
+    states = _cluster_statuses(core, crd, {keys[row.id] for row in rows})
+    _apply_statuses(db, Restaurant, [
+        (row.id, row.status, states[keys[row.id]]) for row in rows if keys[row.id] in states
+    ])